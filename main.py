@@ -1,8 +1,10 @@
 import atexit
 import base64
+import hashlib
 import os
 import shutil
 import tempfile
+from functools import lru_cache
 
 import dash
 from dash import dcc, html
@@ -86,6 +88,10 @@ app.layout = html.Div(
 
 temp_dir = tempfile.mkdtemp()  # Create a dedicated temporary directory for the app
 
+# Number of base64 characters decoded at a time; a multiple of 4, so every
+# block decodes on its own
+DECODE_BLOCK_SIZE = 1 << 20
+
 
 @app.callback(
     [Output("upload-dge-file", "children"), Output("uploaded-dge-path", "data")],
@@ -117,6 +123,12 @@ def update_plots(n_clicks, uploaded_dge_data, gene_name, cluster):
 
     dge_file_path = uploaded_dge_data["path"]
 
+    return analyze(dge_file_path, gene_name, cluster)
+
+
+@lru_cache(maxsize=32)
+def analyze(dge_file_path, gene_name, cluster):
+    # Uploads are named after their content hash, so the path is a safe cache key
     tsne_fig, rsp_fig, _ = gene_analysis(
         dge_file_path, marker_gene=gene_name, target_cluster=cluster, debug=False
     )
@@ -125,12 +137,26 @@ def update_plots(n_clicks, uploaded_dge_data, gene_name, cluster):
 
 
 def save_dge_to_temp_file(content, filename):
-    content_type, content_string = content.split(",")
-    decoded = base64.b64decode(content_string)
-    dge_file_path = os.path.join(temp_dir, f"{filename}_temp.txt")
-
-    with open(dge_file_path, "wb") as f:
-        f.write(decoded)
+    content_type, content_string = content.split(",", 1)
+
+    # Decode and hash in blocks, so the decoded file is never held in memory
+    # in full next to the encoded upload
+    digest = hashlib.sha256()
+
+    # Each upload gets its own scratch file, since callbacks run concurrently
+    fd, partial_path = tempfile.mkstemp(dir=temp_dir, suffix=".part")
+
+    with os.fdopen(fd, "wb") as f:
+        for start in range(0, len(content_string), DECODE_BLOCK_SIZE):
+            block = base64.b64decode(content_string[start : start + DECODE_BLOCK_SIZE])
+            digest.update(block)
+            f.write(block)
+
+    # Name the file after its content, so re-uploading the same data reuses the
+    # parquet and t-SNE caches written next to it, and a different upload never
+    # picks up stale ones
+    dge_file_path = os.path.join(temp_dir, f"{filename}_{digest.hexdigest()[:16]}.txt")
+    os.replace(partial_path, dge_file_path)
 
     # Log the saved path
     print(f"Saved DGE file to {dge_file_path}")
@@ -15,7 +15,13 @@ Key Functions
 - `plot(tsne_coordinates: array, is_expressing: array, title: str) -> None`:
     Plot t-SNE coordinates highlighting specific points.
 
-- `generate_tsne(dge_file: str, output_file: str, marker_gene: str, target_cluster: int, epsilon: int, minpts: int, dev: bool) -> array`:
+- `load_dge(dge_file: str) -> DataFrame`:
+    Load a DGE file once, using the parquet cache next to it when available.
+
+- `compute_clusters(dge_file: str, output_file: str, epsilon: int, minpts: int, debug: bool, dge_data: DataFrame, n_pca: int) -> Tuple[array, array]`:
+    Compute t-SNE coordinates and DBSCAN cluster labels once, for reuse across marker genes.
+
+- `generate_tsne(dge_file: str, output_file: str, marker_gene: str, target_cluster: int, epsilon: int, minpts: int, debug: bool, dge_data: DataFrame, clusters: Tuple[array, array], return_figs: bool) -> Tuple[array, array, go.Figure]`:
     Process DGE files and generate t-SNE coordinates, and perform clustering using DBSCAN.
 
 - `plot_simulated_cells(num_points: int, expression_percentage: float, distribution: str, sigma: float, seed: int, display: bool) -> Tuple[array, array]`:
@@ -4,76 +4,248 @@ It includes options to download plots and CSV data derived from the gene analysi
 """
 
 import os
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from scripts.rsp import generate_polygon, gene_analysis
+from scripts.rsp import generate_polygon, gene_analysis, rsp_areas
 from scripts.simulation import plot_simulated_cells
+from scripts.tsne import compute_clusters, expression_rows, load_dge
 from scripts.util import get_genes, get_gene_info, save_plot
 
+# Data shared with the worker processes of `download`, set once per worker
+_dge_data = None
+_clusters = None
+
+
+def _init_worker(dge_data, clusters):
+    """
+    Store the shared data in a worker process so it is only sent over once.
 
-def download(plots=True, data=True):
+    Parameters:
+    dge_data (pandas.DataFrame): The DGE data loaded by `download`.
+    clusters (tuple): The t-SNE coordinates and cluster labels computed by `download`.
+    """
+
+    global _dge_data, _clusters
+    _dge_data = dge_data
+    _clusters = clusters
+
+
+def process_gene(gene, plots=True, dge_data=None, clusters=None):
+    """
+    Analyze a single gene and optionally save its plots to disk.
+
+    Parameters:
+    gene (str): The gene to analyze.
+    plots (bool): If True, save the t-SNE and RSP plots to 'plots/<gene>'. Default is True.
+    dge_data (pandas.DataFrame): The loaded DGE data. Defaults to the data given to the worker process.
+    clusters (tuple): The t-SNE coordinates and cluster labels. Defaults to the ones given to the worker process.
+
+    Returns:
+    tuple: (coverage, mean_expression, total_expression, rsp_area) for the gene.
+    """
+
+    if dge_data is None:
+        dge_data = _dge_data
+    if clusters is None:
+        clusters = _clusters
+
+    print(f"Reading {gene}...")
+    # Get the gene information
+    info = get_gene_info(dge_file="data/MCA1.txt", target_gene=gene, dge_data=dge_data)
+
+    # Get the RSP Area from the gene_analysis function
+    tsne_fig, rsp_fig, rsp_area = gene_analysis(
+        dge_file="data/MCA1.txt",
+        marker_gene=gene,
+        target_cluster=1,
+        dge_data=dge_data,
+        clusters=clusters,
+        return_figs=plots,
+    )
+
+    if plots:
+        for fig in [tsne_fig, rsp_fig]:
+            os.makedirs(f"plots/{gene}", exist_ok=True)
+            save_plot(fig, f"plots/{gene}/{fig.layout.title.text}.png")
+
+    return info[1], info[2], info[3], rsp_area
+
+
+def analyze_genes(genes, dge_data, clusters, target_cluster=1, chunk_size=512):
+    """
+    Analyze many genes at once, without building any plots.
+
+    Yields the same rows as `process_gene`, in the order of `genes`, but the
+    statistics are computed on whole blocks of genes and the RSP areas share
+    their projections through `rsp_areas`.
+
+    Parameters:
+    genes (list): The genes to analyze.
+    dge_data (pandas.DataFrame): The loaded DGE data.
+    clusters (tuple): The t-SNE coordinates and cluster labels.
+    target_cluster (int): The cluster the RSP areas are computed in. Default is 1.
+    chunk_size (int): Number of genes analyzed per block. Default is 512.
+
+    Yields:
+    tuple: (coverage, mean_expression, total_expression, rsp_area) for each gene.
+    """
+
+    tsne_coordinates, cluster_labels = clusters
+    cluster_mask = cluster_labels == target_cluster
+    cluster_coordinates = tsne_coordinates[cluster_mask]
+
+    # Row of every gene in the DGE data
+    rows = pd.Index(dge_data["GENE"]).get_indexer(genes)
+
+    for start in range(0, len(genes), chunk_size):
+        print(f"Reading genes {start + 1} to {min(start + chunk_size, len(genes))}...")
+        expression = expression_rows(dge_data, rows[start : start + chunk_size])
+        is_expressing = expression > 0
+
+        coverage = np.count_nonzero(is_expressing, axis=1) / expression.shape[1] * 100
+        mean_expression = expression.mean(axis=1)
+        total_expression = expression.sum(axis=1)
+        rsp_area = rsp_areas(cluster_coordinates, is_expressing[:, cluster_mask])
+
+        yield from zip(coverage, mean_expression, total_expression, rsp_area)
+
+
+def download(plots=True, data=True, n_jobs=None):
     """
     Download and analyze gene data. Optionally save plots and CSV data to disk.
 
+    When saving plots, genes are analyzed in parallel across `n_jobs` worker
+    processes; otherwise they are analyzed in blocks by `analyze_genes`. When
+    saving data, finished rows are also written to 'master_file.parquet' as the run
+    progresses, so an interrupted run keeps the genes it already analyzed.
+
     Parameters:
     plots (bool): If True, download and save plots to the 'plots' directory. Default is True.
     data (bool): If True, save gene data to a CSV file. Default is True.
+    n_jobs (int): Number of worker processes used when saving plots. Defaults to the number of CPUs.
     """
 
     if plots:
         os.makedirs("plots", exist_ok=True)
 
-    def collect_rows(rows, new_row):
-        """
-        Append a new row to a list of rows.
+    # Parse the DGE file once and share it across every gene
+    dge_data = load_dge("data/MCA1.txt")
 
-        Parameters:
-        rows (list): The list of existing rows.
-        new_row (dict): The new row to be added to the list.
+    # The t-SNE embedding and clusters do not depend on the marker gene
+    clusters = compute_clusters("data/MCA1.txt", dge_data=dge_data)
 
-        Returns:
-        list: The updated list of rows.
-        """
+    genes = get_genes(
+        dge_file="data/MCA1.txt",
+        target_cluster=1,
+        dge_data=dge_data,
+        clusters=clusters,
+    )
 
-        rows.append(new_row)
-        return rows
+    # One preallocated array per column, filled in gene order; totals keep
+    # the integer type of UMI counts and widen to float if any cell column
+    # holds normalized data
+    num_genes = len(genes)
+    coverage = np.empty(num_genes)
+    mean_expression = np.empty(num_genes)
+    total_expression = np.empty(
+        num_genes, dtype=np.result_type(np.int64, *set(dge_data.dtypes.iloc[1:]))
+    )
+    rsp_area = np.empty(num_genes)
 
-    # List to store rows
-    rows = []
+    writer = None
+    if data:
+        schema = pa.schema(
+            [
+                ("Gene Name", pa.string()),
+                ("Coverage (%)", pa.float64()),
+                ("Mean Expression", pa.float64()),
+                ("Total Expression", pa.from_numpy_dtype(total_expression.dtype)),
+                ("RSP Area", pa.float64()),
+            ]
+        )
+        writer = pq.ParquetWriter("master_file.parquet", schema)
+
+    def write_rows(start, stop):
+        """
+        Append the finished rows in [start, stop) to the parquet checkpoint.
 
-    genes = get_genes(dge_file="data/MCA1.txt", target_cluster=1)
+        Parameters:
+        start (int): Index of the first row to write.
+        stop (int): Index one past the last row to write.
+        """
 
-    for gene in genes:
-        print(f"Reading {gene}...")
-        # Get the gene information
-        info = get_gene_info(dge_file="data/MCA1.txt", target_gene=gene)
+        if stop > start:
+            writer.write_table(
+                pa.table(
+                    [
+                        genes[start:stop],
+                        coverage[start:stop],
+                        mean_expression[start:stop],
+                        total_expression[start:stop],
+                        rsp_area[start:stop],
+                    ],
+                    schema=schema,
+                )
+            )
 
-        # Get the RSP Area from the gene_analysis function
-        tsne_fig, rsp_fig, rsp_area = gene_analysis(
-            dge_file="data/MCA1.txt",
-            marker_gene=gene,
-            target_cluster=1,
-        )
+    # Number of rows analyzed so far, and how many of them are on disk
+    done = 0
+    written = 0
 
-        # Collect data row by row
-        new_row = {
-            "Gene Name": info[0],
-            "Coverage (%)": info[1],
-            "Mean Expression": info[2],
-            "Total Expression": info[3],
-            "RSP Area": rsp_area,
-        }
-        rows = collect_rows(rows, new_row)
+    try:
+        with ExitStack() as stack:
+            if plots:
+                # Genes are independent of each other, so analyze them in parallel
+                executor = stack.enter_context(
+                    ProcessPoolExecutor(
+                        max_workers=n_jobs,
+                        initializer=_init_worker,
+                        initargs=(dge_data, clusters),
+                    )
+                )
+                results = executor.map(
+                    partial(process_gene, plots=plots), genes, chunksize=4
+                )
+            else:
+                # Without plots, whole blocks of genes can be analyzed at once
+                results = analyze_genes(genes, dge_data, clusters)
 
-        if plots:
-            for fig in [tsne_fig, rsp_fig]:
-                os.makedirs(f"plots/{gene}", exist_ok=True)
-                save_plot(fig, f"plots/{gene}/{fig.layout.title.text}.png")
+            for i, result in enumerate(results):
+                (
+                    coverage[i],
+                    mean_expression[i],
+                    total_expression[i],
+                    rsp_area[i],
+                ) = result
+                done = i + 1
+
+                # Checkpoint in batches to keep the parquet row groups large
+                if writer is not None and done - written >= 100:
+                    write_rows(written, done)
+                    written = done
+    finally:
+        if writer is not None:
+            write_rows(written, done)
+            writer.close()
 
     if data:
-        # Convert the list of rows into a DataFrame
-        master_df = pd.DataFrame(rows)
+        # Build the DataFrame from the columns in one shot
+        master_df = pd.DataFrame(
+            {
+                "Gene Name": genes,
+                "Coverage (%)": coverage,
+                "Mean Expression": mean_expression,
+                "Total Expression": total_expression,
+                "RSP Area": rsp_area,
+            }
+        )
 
         # Save the master DataFrame to a CSV file
         master_df.to_csv("master_file.csv", index=False)
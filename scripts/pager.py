@@ -1,15 +1,98 @@
 ############################################
 ### PAGER functions for PAGER server API ###
 ############################################
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import orjson
 import requests
 import numpy as np
 import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Every PAG source known to the PAGER server
+ALL_SOURCES = (
+    "BioCarta",
+    "DSigDB",
+    "GAD",
+    "GeneSigDB",
+    "GOA",
+    "GOA_EXCL",
+    "GTEx",
+    "GWAS Catalog",
+    "Isozyme",
+    "KEGG_2021_HUMAN",
+    "Microcosm Targets",
+    "mirTARbase",
+    "MSigDB",
+    "NCI-Nature Curated",
+    "NGS Catalog",
+    "Pfam",
+    "PharmGKB",
+    "PheWAS",
+    "Protein Lounge",
+    "Reactome_2021",
+    "Spike",
+    "TargetScan",
+    "HPA-normProtein",
+    "HPA-PathologyAtlas",
+    "HPA-CellAtlas",
+    "HPA-RNAcon",
+    "HPA-normRNA",
+    "HPA-GTEx",
+    "HPA-FANTOM5",
+    "HPA-TCGA",
+    "The Genes Reported in Articles Published by Cell",
+    "I2D database, version 2.9",
+    "GeoMx Cancer Transcriptome Atlas",
+    "WikiPathway_2021",
+    "CellMarker",
+)
+
+# The server expects the list of sources joined with "%20"
+_ALL_SOURCES_JOINED = "%20".join(ALL_SOURCES)
+
+
+def _fetch_json(session, method, url, data=None):
+    """Send a request to the PAGER server and decode its JSON response."""
+    # orjson decodes the raw UTF-8 body directly, without building a str first
+    return orjson.loads(session.request(method, url, data=data).content)
+
+
+def _join_rows(df):
+    """Encode the first two columns of a DataFrame in the row format of the nGSEA API."""
+    rows = df.iloc[:, 0].astype(str) + "\\t\\t" + df.iloc[:, 1].astype(str)
+    return "\\t\\t".join(rows + "\\t\\t\\t")
 
 
 class PAGER:
-    def __init__(self):
+    def __init__(self, cache_dir=None):
+        """
+        Parameters:
+        - cache_dir (str, optional): Directory in which API responses are cached on disk, so repeated
+          calls with the same parameters skip the network, even across sessions. Default is None (no caching).
+        """
         self.params = {}
 
+        self._fetch_json = _fetch_json
+        if cache_dir is not None:
+            # The session only carries connections, so it is left out of the cache key
+            self._fetch_json = joblib.Memory(cache_dir, verbose=0).cache(
+                _fetch_json, ignore=["session"]
+            )
+
+        # Share one connection pool across calls, so every request after the
+        # first reuses an open connection to the PAGER server
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=10,
+            max_retries=Retry(total=3, backoff_factor=0.3),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
     def run_pager(self, genes, **kwargs):
         """
         Connects to the PAGER API and performs a hypergeometric test to retrieve enriched PAGs.
@@ -37,46 +120,8 @@ class PAGER:
         - Any provided kwargs will override the default parameters.
         """
 
-        all_sources = [
-            "BioCarta",
-            "DSigDB",
-            "GAD",
-            "GeneSigDB",
-            "GOA",
-            "GOA_EXCL",
-            "GTEx",
-            "GWAS Catalog",
-            "Isozyme",
-            "KEGG_2021_HUMAN",
-            "Microcosm Targets",
-            "mirTARbase",
-            "MSigDB",
-            "NCI-Nature Curated",
-            "NGS Catalog",
-            "Pfam",
-            "PharmGKB",
-            "PheWAS",
-            "Protein Lounge",
-            "Reactome_2021",
-            "Spike",
-            "TargetScan",
-            "HPA-normProtein",
-            "HPA-PathologyAtlas",
-            "HPA-CellAtlas",
-            "HPA-RNAcon",
-            "HPA-normRNA",
-            "HPA-GTEx",
-            "HPA-FANTOM5",
-            "HPA-TCGA",
-            "The Genes Reported in Articles Published by Cell",
-            "I2D database, version 2.9",
-            "GeoMx Cancer Transcriptome Atlas",
-            "WikiPathway_2021",
-            "CellMarker",
-        ]
-
         # Process kwargs to get parameter values or use defaults
-        source = kwargs.get("source", all_sources)
+        source = kwargs.get("source")
         type = kwargs.get("type", "All")
         minSize = kwargs.get("minSize", 1)
         maxSize = kwargs.get("maxSize", 2000)
@@ -90,7 +135,7 @@ class PAGER:
         # Set up parameters and handle encoding issues
         params = {
             "genes": "%20".join(genes),
-            "source": "%20".join(source),
+            "source": _ALL_SOURCES_JOINED if source is None else "%20".join(source),
             "type": type,
             "ge": minSize,
             "le": maxSize,
@@ -103,78 +148,104 @@ class PAGER:
         }
 
         # Make the API call
-        response = requests.post(
+        response = self._fetch_json(
+            self.session,
+            "post",
             "http://discovery.informatics.uab.edu/PAGER/index.php/geneset/pagerapi",
-            data=params,
+            params,
         )
-        return pd.DataFrame(response.json())
+        return pd.DataFrame(response)
 
     def path_member(self, PAG_IDs):
         """Connected to PAGER API to retrieve the membership of PAGs."""
-        params = {"pag": ",".join(PAG_IDs)}
-        response = requests.post(
+        # PAG sets are unordered, so [A, B] and [B, A] share a cache entry
+        params = {"pag": ",".join(sorted(PAG_IDs))}
+        response = self._fetch_json(
+            self.session,
+            "post",
             "http://discovery.informatics.uab.edu/PAGER/index.php/geneset/get_members_by_ids/",
-            data=params,
+            params,
         )
-        return pd.DataFrame(response.json()["data"])
+        return pd.DataFrame(response["data"])
 
     def path_int(self, PAG_IDs):
         """Connected to PAGER API to retrieve the m-type relationships of PAGs."""
-        params = {"pag": ",".join(PAG_IDs)}
-        response = requests.post(
+        # PAG sets are unordered, so [A, B] and [B, A] share a cache entry
+        params = {"pag": ",".join(sorted(PAG_IDs))}
+        response = self._fetch_json(
+            self.session,
+            "post",
             "http://discovery.informatics.uab.edu/PAGER/index.php/pag_pag/inter_network_int_api/",
-            data=params,
+            params,
         )
-        return pd.DataFrame(response.json()["data"])
+        return pd.DataFrame(response["data"])
 
     def path_reg(self, PAG_IDs):
         """Connected to PAGER API to retrieve the r-type relationships of PAGs."""
-        params = {"pag": ",".join(PAG_IDs)}
-        response = requests.post(
+        # PAG sets are unordered, so [A, B] and [B, A] share a cache entry
+        params = {"pag": ",".join(sorted(PAG_IDs))}
+        response = self._fetch_json(
+            self.session,
+            "post",
             "http://discovery.informatics.uab.edu/PAGER/index.php/pag_pag/inter_network_reg_api/",
-            data=params,
+            params,
         )
-        return pd.DataFrame(response.json()["data"])
+        return pd.DataFrame(response["data"])
 
     def pag_ranked_gene(self, PAG_id):
         """Connected to PAGER API to retrieve RP-ranked genes with RP-score."""
-        response = requests.get(
-            f"http://discovery.informatics.uab.edu/PAGER/index.php/genesinPAG/viewgenes/{PAG_id}"
+        response = self._fetch_json(
+            self.session,
+            "get",
+            f"http://discovery.informatics.uab.edu/PAGER/index.php/genesinPAG/viewgenes/{PAG_id}",
         )
-        return pd.DataFrame(response.json()["gene"])
+        return pd.DataFrame(response["gene"])
 
     def pag_gene_int(self, PAG_id):
         """Connected to PAGER API to retrieve gene interaction network."""
-        response = requests.get(
-            f"http://discovery.informatics.uab.edu/PAGER/index.php/pag_mol_mol_map/interactions/{PAG_id}"
+        response = self._fetch_json(
+            self.session,
+            "get",
+            f"http://discovery.informatics.uab.edu/PAGER/index.php/pag_mol_mol_map/interactions/{PAG_id}",
         )
-        return pd.DataFrame(response.json()["data"])
+        return pd.DataFrame(response["data"])
 
     def pag_gene_reg(self, PAG_id):
         """Connected to PAGER API to retrieve gene regulatory network."""
-        response = requests.get(
-            f"http://discovery.informatics.uab.edu/PAGER/index.php/pag_mol_mol_map/regulations/{PAG_id}"
+        response = self._fetch_json(
+            self.session,
+            "get",
+            f"http://discovery.informatics.uab.edu/PAGER/index.php/pag_mol_mol_map/regulations/{PAG_id}",
         )
-        return pd.DataFrame(response.json()["data"])
+        return pd.DataFrame(response["data"])
+
+    def _fetch_many(self, fetch, PAG_ids, max_workers=10):
+        """Run a per-PAG method concurrently over the shared session, keeping the input order."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(fetch, PAG_ids))
+
+    def pag_ranked_gene_many(self, PAG_ids, max_workers=10):
+        """Retrieve the RP-ranked genes of many PAGs concurrently; returns one DataFrame per PAG."""
+        return self._fetch_many(self.pag_ranked_gene, PAG_ids, max_workers)
+
+    def pag_gene_int_many(self, PAG_ids, max_workers=10):
+        """Retrieve the gene interaction networks of many PAGs concurrently; returns one DataFrame per PAG."""
+        return self._fetch_many(self.pag_gene_int, PAG_ids, max_workers)
+
+    def pag_gene_reg_many(self, PAG_ids, max_workers=10):
+        """Retrieve the gene regulatory networks of many PAGs concurrently; returns one DataFrame per PAG."""
+        return self._fetch_many(self.pag_gene_reg, PAG_ids, max_workers)
 
     def path_ngsea(self, genes, PAG_member):
         """Connected to PAGER API to generate the network-based GSEA result."""
-        gene_exp_str = "\\t\\t".join(
-            [
-                f"{row[0]}\\t\\t{row[1]}\\t\\t\\t"
-                for row in genes.itertuples(index=False)
-            ]
-        )
-        pag_sets_str = "\\t\\t".join(
-            [
-                f"{row[0]}\\t\\t{row[1]}\\t\\t\\t"
-                for row in PAG_member.itertuples(index=False)
-            ]
-        )
+        gene_exp_str = _join_rows(genes)
+        pag_sets_str = _join_rows(PAG_member)
 
         params = {"geneExpStr": gene_exp_str, "PAGsetsStr": pag_sets_str}
-        response = requests.post(
+        response = self._fetch_json(
+            self.session,
+            "post",
             "http://discovery.informatics.uab.edu/PAGER/index.php/geneset/ngseaapi/",
-            data=params,
+            params,
         )
-        return pd.DataFrame(response.json()["data"])
+        return pd.DataFrame(response["data"])
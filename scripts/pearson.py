@@ -1,9 +1,9 @@
+import numpy as np
 import pandas as pd
-from scipy.stats import pearsonr
-import itertools
+from scipy.stats import t
 
 # Load your data: replace 'your_data.csv' with your file path
-data = pd.read_csv("data/MCA1_lung.csv")
+data = pd.read_csv("data/MCA1_lung.csv", engine="pyarrow")
 data.set_index("GENE", inplace=True)
 
 # Potential genes to compare
@@ -11,25 +11,28 @@ potential_genes = [
     # ...
 ]
 
-# Calculate Pearson Correlation Coefficients
-correlations = {}
-p_values = {}
-
-# Iterate over all possible pairs of genes
-for gene1, gene2 in itertools.combinations(potential_genes, 2):
-    if gene1 in data.index and gene2 in data.index:
-        corr, p_value = pearsonr(data.loc[gene1], data.loc[gene2])
-        correlations[(gene1, gene2)] = corr
-        p_values[(gene1, gene2)] = p_value
-
-# Convert to DataFrame for easier handling
-correlation_df = pd.DataFrame.from_dict(
-    correlations, orient="index", columns=["Pearson_Correlation"]
+# Expression of the genes present in the data, one row per gene
+present_genes = [gene for gene in potential_genes if gene in data.index]
+expression = data.loc[present_genes].to_numpy(dtype=np.float64)
+
+# Calculate all Pearson Correlation Coefficients at once; the upper triangle
+# holds every pair, in the same order as itertools.combinations
+correlation_matrix = np.atleast_2d(np.corrcoef(expression))
+rows, cols = np.triu_indices(len(present_genes), k=1)
+correlations = correlation_matrix[rows, cols]
+
+# Two-sided p-values from the t distribution, as computed by pearsonr
+dof = expression.shape[1] - 2
+with np.errstate(divide="ignore"):
+    t_stat = correlations * np.sqrt(dof / (1 - correlations**2))
+p_values = 2 * t.sf(np.abs(t_stat), dof)
+
+# Combine both into a DataFrame indexed by gene pair
+gene_names = np.array(present_genes, dtype=object)
+result_df = pd.DataFrame(
+    {"Pearson_Correlation": correlations, "P_Value": p_values},
+    index=pd.Index(list(zip(gene_names[rows], gene_names[cols])), tupleize_cols=False),
 )
-p_value_df = pd.DataFrame.from_dict(p_values, orient="index", columns=["P_Value"])
-
-# Combine both DataFrames
-result_df = pd.concat([correlation_df, p_value_df], axis=1)
 
 # Filtering for significant results
 # Adjust the threshold as necessary
@@ -5,6 +5,7 @@ The primary functionality allows users to:
 
 1. Generate a polygonal representation of data distributions given certain coordinates.
 2. Conduct a comprehensive gene analysis by generating t-SNE plots and RSP plots for a specified marker gene and target cluster.
+3. Compute RSP areas for many genes at once over the same set of coordinates.
 """
 
 import numpy as np
@@ -12,8 +13,135 @@ import plotly.graph_objects as go
 
 from scripts.tsne import generate_tsne
 
+# Number of angles scanned, and of histogram bins per angle, in an RSP
+RESOLUTION = 1000
 
-def generate_polygon(coordinates, is_expressing, theta_bound=[0, 2 * np.pi]):
+# Largest number of (cell, angle) projections held in memory at once; with
+# many cells, the angles are scanned in blocks so memory stays O(N)
+BLOCK_ELEMENTS = 1 << 22
+
+
+def _projection_bins(coordinates, thetas, resolution=RESOLUTION):
+    """
+    Bin the projection of every coordinate onto every scanning angle.
+
+    For each angle, the projections are rescaled to [0, 1] over all of the
+    given coordinates and split into `resolution` equal-width bins. Since the
+    rescaling only depends on the coordinates, the bins can be shared by every
+    gene measured on the same cells.
+
+    Parameters:
+    - coordinates (np.ndarray): A 2D array of x and y coordinates.
+    - thetas (np.ndarray): The scanning angles.
+    - resolution (int, optional): The number of bins per angle. Default is RESOLUTION.
+
+    Returns:
+    - bins (np.ndarray): An int32 array of shape (len(coordinates), len(thetas)); entry [i, t] is the bin of coordinate i at angle t, offset by t * resolution so the bins of all angles can be counted in one np.bincount call.
+    """
+    # t-SNE coordinates have far more precision than 1000 bins need, so
+    # project in float32 to halve the memory traffic of the (N, R) matrices
+    coordinates = np.ascontiguousarray(coordinates, dtype=np.float32)
+    directions = np.stack([np.cos(thetas), np.sin(thetas)]).astype(np.float32)
+    projections = coordinates @ directions
+
+    min_val = projections.min(axis=0)
+    norm_denom = projections.max(axis=0) - min_val
+
+    # Where every point projects to the same value, they all fall in bin 0
+    norm_denom[norm_denom == 0] = 1
+
+    # Rescale in place, so the projections are the only float temporary
+    projections -= min_val
+    projections /= norm_denom
+    projections *= resolution
+
+    # The offset bins of RESOLUTION angles stay far below the int32 limit
+    bins = projections.astype(np.int32)
+    del projections
+
+    # The maximum projection falls in the last bin, as with np.histogram
+    np.minimum(bins, resolution - 1, out=bins)
+    bins += np.arange(len(thetas), dtype=np.int32) * resolution
+
+    return bins
+
+
+def _angle_differences(coordinates, thetas, is_expressing, resolution=RESOLUTION):
+    """
+    Compute the CDF differences of one or more genes at every scanning angle.
+
+    The angles are scanned in blocks of at most BLOCK_ELEMENTS projections,
+    so the bins of only one block are held in memory at a time; with few
+    cells, all angles fit in a single block.
+
+    Parameters:
+    - coordinates (np.ndarray): A 2D array of x and y coordinates.
+    - thetas (np.ndarray): The scanning angles.
+    - is_expressing (np.ndarray): Boolean array of shape (n_genes, len(coordinates)); no gene may be expressed in every coordinate.
+    - resolution (int, optional): The number of bins per angle. Default is RESOLUTION.
+
+    Returns:
+    - differences (np.ndarray): Array of shape (n_genes, len(thetas)) with the CDF difference of each gene at each angle.
+    """
+    differences = np.empty((len(is_expressing), len(thetas)))
+    block_size = max(1, BLOCK_ELEMENTS // max(len(coordinates), 1))
+
+    for start in range(0, len(thetas), block_size):
+        block = slice(start, start + block_size)
+
+        # Bin every projection at every angle of the block at once, then
+        # count the histograms of all its angles in one pass each
+        bins = _projection_bins(coordinates, thetas[block], resolution)
+        total_hist_values = np.bincount(
+            bins.ravel(), minlength=bins.shape[1] * resolution
+        )
+
+        for i, gene_expressing in enumerate(is_expressing):
+            differences[i, block] = _cdf_differences(
+                bins, total_hist_values, gene_expressing, resolution
+            )
+
+    return differences
+
+
+def _cdf_differences(bins, total_hist_values, is_expressing, resolution=RESOLUTION):
+    """
+    Compute the summed absolute difference between the foreground and
+    background CDFs at every scanning angle.
+
+    Parameters:
+    - bins (np.ndarray): The projection bins, as returned by `_projection_bins`.
+    - total_hist_values (np.ndarray): np.bincount of all of `bins`.
+    - is_expressing (np.ndarray): Boolean array indicating the expressing status of each coordinate.
+    - resolution (int, optional): The number of bins per angle. Default is RESOLUTION.
+
+    Returns:
+    - differences (np.ndarray): The CDF difference at each angle.
+    """
+    num_thetas = bins.shape[1]
+
+    foreground_hist_values = np.bincount(
+        bins[is_expressing].ravel(), minlength=num_thetas * resolution
+    )
+    background_hist_values = total_hist_values - foreground_hist_values
+
+    # Compute CDFs, one row per angle
+    foreground_cdf = np.cumsum(
+        foreground_hist_values.reshape(num_thetas, resolution), axis=1
+    )
+    foreground_cdf = foreground_cdf / foreground_cdf[:, -1:]
+
+    background_cdf = np.cumsum(
+        background_hist_values.reshape(num_thetas, resolution), axis=1
+    )
+    background_cdf = background_cdf / background_cdf[:, -1:]
+
+    return np.abs(foreground_cdf - background_cdf).sum(axis=1)
+
+
+def generate_polygon(
+    coordinates, is_expressing, theta_bound=[0, 2 * np.pi], return_figs=True
+):
     """
     Generates a polygonal representation of data distributions using given coordinates.
 
@@ -21,9 +149,11 @@ def generate_polygon(coordinates, is_expressing, theta_bound=[0, 2 * np.pi]):
     - coordinates (np.ndarray): A 2D array of x and y coordinates.
     - is_expressing (np.ndarray): Boolean array indicating the expressing status of each coordinate.
     - theta_bound (list, optional): Boundaries for the angle theta. Default is [0, 2 * np.pi].
+    - return_figs (bool, optional): Whether to build the Plotly figure. Default is True.
 
     Returns:
-    - rsp_fig (plotly.graph_objects.Figure): A Plotly figure representing the generated polygon.
+    - rsp_fig (plotly.graph_objects.Figure): A Plotly figure representing the generated polygon, or None if return_figs is False.
+    - polygon_area (float): The area of the polygon.
 
     Example:
     >>> coords = np.array([[1,2],[3,4],[5,6]])
@@ -31,78 +161,44 @@ def generate_polygon(coordinates, is_expressing, theta_bound=[0, 2 * np.pi]):
     >>> fig = generate_polygon(coords, expressing)
     >>> fig.show()
     """
-    resolution = 1000
+    resolution = RESOLUTION
     theta_start, theta_end = theta_bound
     angle_step = (theta_end - theta_start) / resolution
 
-    foreground_coordinates = coordinates[is_expressing]
-    background_coordinates = coordinates[~is_expressing]
+    total_expressing_cells = np.count_nonzero(is_expressing)
 
-    total_expressing_cells = sum(is_expressing)
-
-    differences = []
+    thetas = np.linspace(theta_start, theta_end, resolution)
 
     # Edge case: the particular gene is expressed in all cells
     #            usually, this applies to some mitocondrial genes
-    if len(background_coordinates) == 0:
-        differences = [0] * resolution
-    else:
-        for theta in np.linspace(theta_start, theta_end, resolution):
-            # Compute projections
-            foreground_projection = (
-                np.cos(theta) * foreground_coordinates[:, 0]
-                + np.sin(theta) * foreground_coordinates[:, 1]
-            )
-            background_projection = (
-                np.cos(theta) * background_coordinates[:, 0]
-                + np.sin(theta) * background_coordinates[:, 1]
-            )
-
-            min_val = min(foreground_projection.min(), background_projection.min())
-            max_val = max(foreground_projection.max(), background_projection.max())
+    if total_expressing_cells == len(is_expressing):
+        # The polygon collapses to a point, so without a figure to draw
+        # there is nothing left to compute
+        if not return_figs:
+            return None, 0.0
 
-            norm_denom = max_val - min_val
-            foreground_projection = (foreground_projection - min_val) / norm_denom
-            background_projection = (background_projection - min_val) / norm_denom
-
-            foreground_hist_values, _ = np.histogram(
-                foreground_projection, bins=resolution, range=(0, 1)
-            )
-            background_hist_values, _ = np.histogram(
-                background_projection, bins=resolution, range=(0, 1)
-            )
-
-            # Compute CDFs
-            foreground_cdf = np.cumsum(foreground_hist_values)
-            foreground_cdf = foreground_cdf / foreground_cdf[-1]
-
-            background_cdf = np.cumsum(background_hist_values)
-            background_cdf = background_cdf / background_cdf[-1]
-
-            difference = foreground_cdf - background_cdf
-            differences.append(np.sum(np.abs(difference)))
+        differences = np.zeros(resolution)
+    else:
+        differences = _angle_differences(coordinates, thetas, [is_expressing])[0]
 
-    # Construct the polygon
-    angles = []
-    radii = []
+    # Construct the polygon; every angle contributes the two vertices
+    # (theta, h) and (theta + angle_step, h)
+    h = differences / (np.sin(angle_step / 2) * resolution)
 
-    for theta, diff in zip(
-        np.linspace(theta_start, theta_end, resolution), differences
-    ):
-        h = diff / (np.sin(angle_step / 2) * resolution)
-        angles.extend([theta, theta + angle_step])
-        radii.extend([h, h])
+    angles = np.empty(2 * resolution)
+    angles[0::2] = thetas
+    angles[1::2] = thetas + angle_step
 
     # Normalize radii
-    radii = [r / total_expressing_cells for r in radii]
+    radii = np.repeat(h, 2) / total_expressing_cells
 
-    segment_areas = []
-    for i in range(0, len(radii) - 1, 2):
-        theta_diff = angles[i + 1] - angles[i]
-        segment_area = 0.5 * theta_diff * (radii[i] ** 2 + radii[i + 1] ** 2)
-        segment_areas.append(segment_area)
+    # The original area summed 0.5 * angle_step * (r_i^2 + r_(i+1)^2) over
+    # consecutive vertices; both vertices of an angle share its radius, so
+    # each angle contributes angle_step * r^2 to that sum
+    polygon_area = angle_step * np.sum(radii[0::2] ** 2)
 
-    polygon_area = np.sum(segment_areas)
+    if not return_figs:
+        return None, polygon_area
 
     # Plotly polar plot for the polygon
     rsp_fig = go.Figure()
@@ -149,6 +245,9 @@ def gene_analysis(
     target_cluster=None,
     theta_bound=[0, 2 * np.pi],
     debug=False,
+    dge_data=None,
+    clusters=None,
+    return_figs=True,
 ):
     """
     Performs gene analysis by generating t-SNE and RSP plots for a given marker gene and target cluster.
@@ -158,6 +257,9 @@ def gene_analysis(
     - marker_gene (str, optional): The marker gene of interest. Default is None.
     - target_cluster (str, optional): The target cluster to focus on. Default is None.
     - theta_bound (list, optional): Boundaries for the angle theta used in the RSP plot. Default is [0, 2 * np.pi].
+    - dge_data (pandas.DataFrame, optional): Already-loaded DGE data; if given, the DGE file is not read. Default is None.
+    - clusters (tuple, optional): Precomputed `(tsne_coordinates, cluster_labels)` from `compute_clusters`; if given, t-SNE and DBSCAN are not rerun. Default is None.
+    - return_figs (bool, optional): Whether to build the t-SNE and RSP figures; when False, both are returned as None. Default is True.
 
     Returns:
     - tsne_fig (plotly.graph_objects.Figure): A Plotly figure representing the t-SNE plot.
@@ -169,15 +271,72 @@ def gene_analysis(
     >>> rsp_fig.show()
     """
     tsne_coordinates, is_expressing, tsne_fig = generate_tsne(
-        dge_file, marker_gene=marker_gene, target_cluster=target_cluster, debug=debug
+        dge_file,
+        marker_gene=marker_gene,
+        target_cluster=target_cluster,
+        debug=debug,
+        dge_data=dge_data,
+        clusters=clusters,
+        return_figs=return_figs,
     )
 
     rsp_fig, rsp_area = generate_polygon(
-        tsne_coordinates, is_expressing, theta_bound=theta_bound
+        tsne_coordinates,
+        is_expressing,
+        theta_bound=theta_bound,
+        return_figs=return_figs,
     )
 
-    rsp_fig.update_layout(
-        title=f"RSP plot with marker gene '{marker_gene}'",
-    )
+    if return_figs:
+        rsp_fig.update_layout(
+            title=f"RSP plot with marker gene '{marker_gene}'",
+        )
 
     return tsne_fig, rsp_fig, rsp_area
+
+
+def rsp_areas(coordinates, is_expressing, theta_bound=[0, 2 * np.pi]):
+    """
+    Computes the RSP area of many genes measured on the same coordinates.
+
+    This gives the same areas as calling `generate_polygon` once per gene, but
+    the projections and bins are computed once and shared by every gene, so
+    each gene only costs one histogram pass over its expressing cells.
+
+    Parameters:
+    - coordinates (np.ndarray): A 2D array of x and y coordinates.
+    - is_expressing (np.ndarray): Boolean array of shape (n_genes, len(coordinates)) indicating which coordinates express each gene.
+    - theta_bound (list, optional): Boundaries for the angle theta. Default is [0, 2 * np.pi].
+
+    Returns:
+    - areas (np.ndarray): The RSP area of each gene.
+
+    Example:
+    >>> coords = np.array([[1,2],[3,4],[5,6]])
+    >>> expressing = np.array([[True, False, True], [False, True, True]])
+    >>> areas = rsp_areas(coords, expressing)
+    """
+    resolution = RESOLUTION
+    theta_start, theta_end = theta_bound
+    angle_step = (theta_end - theta_start) / resolution
+
+    thetas = np.linspace(theta_start, theta_end, resolution)
+
+    areas = np.zeros(len(is_expressing))
+    total_expressing_cells = np.count_nonzero(is_expressing, axis=1)
+
+    # Genes expressed in all cells have no background, and an area of 0
+    partial = total_expressing_cells < is_expressing.shape[1]
+    if not partial.any():
+        return areas
+
+    differences = _angle_differences(coordinates, thetas, is_expressing[partial])
+
+    # Polygon radii and area, as in generate_polygon; each angle contributes
+    # angle_step * r^2, reproducing the original two-vertex sum
+    radii = differences / (
+        np.sin(angle_step / 2) * resolution * total_expressing_cells[partial, None]
+    )
+    areas[partial] = angle_step * np.sum(radii**2, axis=1)
+
+    return areas
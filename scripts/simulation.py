@@ -11,6 +11,33 @@ scatter plot showing cells in a unit circle, with a subset of them representing
 import numpy as np
 import plotly.graph_objects as go
 
+# Number of cells above which the simulated cells are drawn as density contours
+DENSITY_THRESHOLD = 5000
+
+
+def _sample_in_unit_circle(draw, num_points):
+    """
+    Rejection-sample points that lie within the unit circle, in batches.
+
+    Parameters:
+    - draw (callable): Function that returns an (n, 2) array of n candidate points.
+    - num_points (int): Number of points to return.
+
+    Returns:
+    - points (numpy array): Array of num_points accepted points, in the order they were drawn.
+    """
+    points = np.empty((0, 2))
+
+    while len(points) < num_points:
+        missing = num_points - len(points)
+
+        # Oversample, so a single batch is usually enough
+        candidates = draw(int(missing * 1.3) + 64)
+        candidates = candidates[(candidates**2).sum(axis=1) <= 1]
+        points = np.concatenate([points, candidates[:missing]])
+
+    return points
+
 
 def plot_simulated_cells(
     num_points,
@@ -25,7 +52,8 @@ def plot_simulated_cells(
     Generate points with coordinates between -1 and 1 using uniform sampling.
     The point is accepted if it satisfies the condition x^2 + y^2 ≤ 1.
     A percentage of the points are randomly chosen to represent the cells
-    expressing the gene, and the points are plotted.
+    expressing the gene, and the points are plotted; above DENSITY_THRESHOLD
+    points, each group is drawn as density contours instead.
 
     Parameters:
     - num_points (int): Number of points to generate.
@@ -38,7 +66,7 @@ def plot_simulated_cells(
     - center (tuple, optional): Tuple containing the minimum and maximum values for generating the center of the biased distribution; defaults to (-0.5, 0.5).
 
     Returns:
-    - coordinates (numpy array): Array containing the generated points.
+    - coordinates (numpy array): float32 array containing the generated points.
     - is_expressing (numpy array): Boolean array indicating whether each point represents a cell expressing the gene.
 
     Example:
@@ -46,65 +74,76 @@ def plot_simulated_cells(
     """
 
     # Setting the seed for reproducibility
-    if seed is not None:
-        np.random.seed(seed)
+    rng = np.random.default_rng(seed)
 
-    coordinates = np.zeros((num_points, 2))
     is_expressing = np.zeros(num_points, dtype=bool)
 
-    count = 0
-    while count < num_points:
-        x, y = np.random.uniform(-1, 1, 2)
-        if x**2 + y**2 <= 1:
-            coordinates[count] = [x, y]
-            count += 1
+    coordinates = _sample_in_unit_circle(
+        lambda n: rng.uniform(-1, 1, (n, 2)), num_points
+    )
 
     # Randomly choose a percentage of points to represent the cells expressing the gene
-    expressing_indices = np.random.choice(
+    expressing_indices = rng.choice(
         num_points, int(num_points * expression_percentage), replace=False
     )
 
     if distribution == "biased":
         # Define a random center for the Gaussian distribution using the provided range
-        center_x, center_y = np.random.uniform(center[0], center[1], 2)
-
-        for idx in expressing_indices:
-            x = center_x + np.random.normal(0, sigma)
-            y = center_y + np.random.normal(0, sigma)
-
-            # If the point lies outside the main circle, bring it back within the circle
-            while x**2 + y**2 > 1:
-                x = center_x + np.random.normal(0, sigma)
-                y = center_y + np.random.normal(0, sigma)
+        center_xy = rng.uniform(center[0], center[1], 2)
 
-            coordinates[idx] = [x, y]
+        # Points that fall outside the main circle are redrawn
+        coordinates[expressing_indices] = _sample_in_unit_circle(
+            lambda n: center_xy + rng.normal(0, sigma, (n, 2)),
+            len(expressing_indices),
+        )
 
     is_expressing[expressing_indices] = True
 
+    # Single precision is plenty for plotting, and halves the size of the figure data
+    coordinates = coordinates.astype(np.float32)
+
     # Plotting with Plotly
     fig = go.Figure()
 
-    # Plot for background cells
-    fig.add_trace(
-        go.Scatter(
-            x=coordinates[~is_expressing, 0],
-            y=coordinates[~is_expressing, 1],
-            mode="markers",
-            marker=dict(color="gray", size=5, opacity=0.25),
-            name="Background",
+    if num_points > DENSITY_THRESHOLD:
+        # Too many cells to draw one by one, so outline the density of each group
+        for mask, name, colorscale in [
+            (~is_expressing, "Background", "Greys"),
+            (is_expressing, "Expressing Cells", "Reds"),
+        ]:
+            fig.add_trace(
+                go.Histogram2dContour(
+                    x=coordinates[mask, 0],
+                    y=coordinates[mask, 1],
+                    colorscale=colorscale,
+                    contours=dict(coloring="lines"),
+                    showscale=False,
+                    showlegend=True,
+                    name=name,
+                )
+            )
+    else:
+        # Plot for background cells
+        fig.add_trace(
+            go.Scattergl(
+                x=coordinates[~is_expressing, 0],
+                y=coordinates[~is_expressing, 1],
+                mode="markers",
+                marker=dict(color="gray", size=5, opacity=0.25),
+                name="Background",
+            )
         )
-    )
 
-    # Plot for expressing cells
-    fig.add_trace(
-        go.Scatter(
-            x=coordinates[is_expressing, 0],
-            y=coordinates[is_expressing, 1],
-            mode="markers",
-            marker=dict(color="red", size=5),
-            name="Expressing Cells",
+        # Plot for expressing cells
+        fig.add_trace(
+            go.Scattergl(
+                x=coordinates[is_expressing, 0],
+                y=coordinates[is_expressing, 1],
+                mode="markers",
+                marker=dict(color="red", size=5),
+                name="Expressing Cells",
+            )
         )
-    )
 
     fig.update_layout(
         title=f"{distribution.capitalize()} Distribution with {expression_percentage*100}% Expressing Cells",
@@ -1,11 +1,17 @@
+import csv
 import os
+from functools import lru_cache
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 import plotly.graph_objects as go
 import plotly.express as px
+from scipy.spatial import cKDTree
 from sklearn.cluster import DBSCAN
+from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
-from sklearn.metrics import pairwise_distances
 
 
 def plot_k_distance_graph(tsne_coordinates, k):
@@ -19,8 +25,12 @@ def plot_k_distance_graph(tsne_coordinates, k):
     Example:
     >>> plot_k_distance_graph(3)
     """
-    dists = pairwise_distances(tsne_coordinates)
-    k_dists = np.sort(dists, axis=1)[:, k]
+    # Query each point's k nearest neighbors with a tree, on all cores,
+    # instead of building the full pairwise distance matrix; the closest
+    # match of every point is itself, hence k + 1
+    tree = cKDTree(tsne_coordinates)
+    dists, _ = tree.query(tsne_coordinates, k=k + 1, workers=-1)
+    k_dists = dists[:, -1]
     sorted_k_dists = np.sort(k_dists)
 
     fig = px.line(
@@ -32,90 +42,215 @@ def plot_k_distance_graph(tsne_coordinates, k):
     fig.show()
 
 
-def generate_tsne(
+def expression_rows(dge_data, rows):
+    """
+    Get the expression values of some genes from the DGE data.
+
+    Parameters:
+    - dge_data (pandas.DataFrame): The DGE data, as returned by `load_dge`.
+    - rows (array): The positions of the genes' rows in `dge_data`.
+
+    Returns:
+    - expression (numpy.ndarray): Array of shape (len(rows), number of cells).
+    """
+    # Take the rows before dropping the "GENE" column; slicing the columns
+    # first copies the whole expression matrix
+    return dge_data.iloc[rows].iloc[:, 1:].to_numpy()
+
+
+def load_dge(dge_file):
+    """
+    Load a DGE file, reading from (and populating) the parquet cache stored
+    next to it.
+
+    The last file loaded is also kept in memory, keyed on its path and
+    modification time, so repeated loads of an unchanged file return the
+    same DataFrame without touching the disk. Its expression values are
+    read-only, since they are shared by every caller.
+
+    Parameters:
+    - dge_file (str): The path to the DGE file.
+
+    Returns:
+    - dge_data (pandas.DataFrame): The DGE data, with a "GENE" column followed by one column per cell.
+
+    Example:
+    >>> dge_data = load_dge("data/MCA1.txt")
+    """
+    dge_file = os.path.abspath(dge_file)
+    cache_file = f"{os.path.splitext(dge_file)[0]}.dge.parquet"
+
+    # Key on the file the data is actually read from
+    source_file = cache_file if os.path.isfile(cache_file) else dge_file
+
+    return _read_dge(dge_file, os.path.getmtime(source_file))
+
+
+def _to_dge_frame(table):
+    """
+    Convert a DGE table read by PyArrow to a DataFrame for `load_dge`.
+
+    The expression values are copied once into a single read-only matrix,
+    so writing to them through the shared DataFrame raises an error; cell
+    columns of mixed types are promoted to a common one.
+    """
+    cells = table.column_names[1:]
+
+    # Missing values become NaN, as with pandas: columns with nulls that are
+    # not floating point (including all-null ones) are read as float64
+    columns = []
+    for cell in cells:
+        column = table.column(cell)
+        if column.null_count > 0 and not pa.types.is_floating(column.type):
+            column = column.cast(pa.float64())
+        columns.append(column)
+
+    dtype = np.result_type(*{column.type.to_pandas_dtype() for column in columns})
+
+    # Column-major, so every cell column is one contiguous block, as in pandas
+    values = np.empty((table.num_rows, len(cells)), dtype=dtype, order="F")
+    for i, column in enumerate(columns):
+        values[:, i] = column.to_numpy()
+    values.flags.writeable = False
+
+    dge_data = pd.DataFrame(values, columns=cells, copy=False)
+    dge_data.insert(
+        0, table.column_names[0], table.column(0).to_numpy(zero_copy_only=False)
+    )
+
+    return dge_data
+
+
+# Only the last file is kept, since a DGE can take up several hundred MB
+@lru_cache(maxsize=1)
+def _read_dge(dge_file, mtime):
+    """
+    Read a DGE file for `load_dge`; `mtime` is only part of the cache key.
+    """
+    split_filename = os.path.splitext(dge_file)[0]
+
+    if os.path.isfile(f"{split_filename}.dge.parquet"):
+        # Reading cache
+        return _to_dge_frame(pq.read_table(f"{split_filename}.dge.parquet"))
+
+    # Sniff the delimiter from the header, like pandas does for sep=None
+    with open(dge_file, "r", newline="") as f:
+        header = f.readline()
+        delimiter = csv.Sniffer().sniff(header).delimiter
+
+    # The PyArrow reader parses the file on all cores, in blocks that must
+    # each hold a whole row; with many cells the header is the longest one
+    table = pv.read_csv(
+        dge_file,
+        read_options=pv.ReadOptions(
+            use_threads=True, block_size=max(1 << 20, 4 * len(header))
+        ),
+        parse_options=pv.ParseOptions(delimiter=delimiter),
+    )
+
+    # Caching
+    pq.write_table(table, f"{split_filename}.dge.parquet")
+
+    return _to_dge_frame(table)
+
+
+def compute_clusters(
     dge_file,
     output_file=None,
-    marker_gene=None,
-    target_cluster=None,
     epsilon=4,
     minpts=40,
     debug=False,
+    dge_data=None,
+    n_pca=50,
 ):
     """
-    Generate t-SNE 2D coordinates from DGE file and cluster using DBSCAN.
+    Compute t-SNE 2D coordinates from a DGE file and cluster them using DBSCAN.
+
+    The result only depends on the expression matrix and the DBSCAN settings,
+    not on any marker gene, so it can be computed once and passed to
+    `generate_tsne` for every gene of interest.
 
     Parameters:
     - dge_file (str): The path to the DGE file.
     - output_file (str): The path to the output file; defaults to
-      the same directory as the DGE file with a .tsne.csv extension.
-    - marker_gene (str): The name of the marker gene to highlight.
-    - target_cluster (int): The target cluster to highlight.
+      the same directory as the DGE file with a .tsne.npy extension.
+      Files with any other extension are read and written as CSV.
     - epsilon (int): The epsilon value for DBSCAN.
     - minpts (int): The minpts value for DBSCAN.
     - debug (bool): Whether to print debug information.
+    - dge_data (pandas.DataFrame): Already-loaded DGE data, as returned by
+      `load_dge`; if given, the DGE file is not read again.
+    - n_pca (int): The number of principal components the expression matrix
+      is reduced to before running t-SNE.
 
     Returns:
-    - filtered_tsne_coordinates (numpy.ndarray): A filtered set of t-SNE coordinates. If a marker gene or target cluster is specified, this contains only the coordinates for cells expressing the gene or belonging to the target cluster, respectively.
-    - is_expressing (numpy.ndarray or None): A boolean array indicating which cells (of the filtered set) are expressing the specified marker gene. If no marker gene is specified, this is None.
-    - fig (plotly.graph_objects.Figure): A Plotly figure object visualizing the t-SNE plot with either DBSCAN clusters or highlighted cells based on marker gene expression.
+    - tsne_coordinates (numpy.ndarray): The t-SNE coordinates of every cell.
+    - cluster_labels (numpy.ndarray): The DBSCAN cluster of every cell, numbered from 1; noise points are labelled -1.
+
+    Example:
+    >>> tsne_coordinates, cluster_labels = compute_clusters("data/MCA1.txt")
     """
 
-    dge_data = None
     expression_matrix = None
     tsne_coordinates = None
     cluster_labels = None
 
-    if debug:
-        print(f"Running in debug mode!")
-
     split_filename = os.path.splitext(dge_file)[0]
 
     if output_file is None:
-        output_file = split_filename + ".tsne.csv"
+        output_file = split_filename + ".tsne.npy"
 
         if debug:
             print(f"Defaulting output file directory to {output_file}.")
 
-    # Read the DGE file
-    if os.path.isfile(f"{split_filename}.dge.parquet"):
-        # Reading cache
-        dge_data = pd.read_parquet(f"{split_filename}.dge.parquet")
-    else:
-        dge_data = pd.read_csv(dge_file, sep=None, engine="python")
+        # Convert coordinates cached as CSV by older versions
+        legacy_file = split_filename + ".tsne.csv"
+        if not os.path.isfile(output_file) and os.path.isfile(legacy_file):
+            np.save(output_file, pd.read_csv(legacy_file).values.astype(np.float32))
 
-        # Caching
-        dge_data.to_parquet(f"{split_filename}.dge.parquet")
+    if not os.path.isfile(output_file):
+        # Read the DGE file
+        if dge_data is None:
+            dge_data = load_dge(dge_file)
 
-    if os.path.isfile(output_file):
-        # Read the coordinates from the output file if it exists
-        tsne_coordinates = pd.read_csv(output_file).values
-    else:
-        # Generate t-SNE coordinates
-        expression_matrix = dge_data.drop(columns=["GENE"]).values.T.astype(float)
+        # Generate t-SNE coordinates, converting straight to float32 instead
+        # of copying the counts first
+        expression_matrix = dge_data.drop(columns=["GENE"]).to_numpy(np.float32).T
 
         if debug:
             print(
                 f"Loaded {expression_matrix.shape[1]} genes in {expression_matrix.shape[0]} cells."
             )
 
-        tsne = TSNE()
-        tsne_coordinates = tsne.fit_transform(expression_matrix)
-        pd.DataFrame(tsne_coordinates).to_csv(
-            output_file, index=False, header=["X", "Y"]
+        # Reduce to the leading principal components first, so the neighbor
+        # search inside t-SNE works on n_pca dimensions instead of every gene
+        pca = PCA(
+            n_components=min(n_pca, *expression_matrix.shape),
+            svd_solver="randomized",
+            random_state=0,
         )
+        expression_matrix = pca.fit_transform(expression_matrix)
 
-    if debug:
-        plot_k_distance_graph(tsne_coordinates, minpts)
-        print(input("Press Enter to continue..."))
+        # Run the neighbor search of Barnes-Hut t-SNE on every core
+        tsne = TSNE(n_jobs=-1)
+        tsne_coordinates = tsne.fit_transform(expression_matrix).astype(np.float32)
 
-    # Calculate cluster IDs using DBSCAN
-    dbscan = DBSCAN(eps=epsilon, min_samples=minpts)
-    cluster_labels = dbscan.fit_predict(tsne_coordinates)
-    cluster_labels[cluster_labels != -1] = cluster_labels[cluster_labels != -1] + 1
+        if output_file.endswith(".npy"):
+            np.save(output_file, tsne_coordinates)
+        else:
+            pd.DataFrame(tsne_coordinates).to_csv(
+                output_file, index=False, header=["X", "Y"]
+            )
 
-    fig = go.Figure()
+    # Reuse the clusters of an unchanged embedding within the session
+    tsne_coordinates, cluster_labels = _cluster_embedding(
+        os.path.abspath(output_file), os.path.getmtime(output_file), epsilon, minpts
+    )
 
     if debug:
+        plot_k_distance_graph(tsne_coordinates, minpts)
+        print(input("Press Enter to continue..."))
+
         # Print number of noise points and number of points in each cluster
         print(
             "Number of noise points: {}".format(
@@ -129,81 +264,185 @@ def generate_tsne(
                 )
             )
 
+    return tsne_coordinates, cluster_labels
+
+
+@lru_cache(maxsize=8)
+def _cluster_embedding(output_file, mtime, epsilon, minpts):
+    """
+    Read the t-SNE coordinates cached by `compute_clusters` and cluster them
+    using DBSCAN; `mtime` is only part of the cache key. Both returned arrays
+    are read-only, since they are shared by every caller.
+    """
+    # Read the coordinates from the output file
+    if output_file.endswith(".npy"):
+        tsne_coordinates = np.load(output_file, mmap_mode="r")
+    else:
+        tsne_coordinates = pd.read_csv(output_file).values
+        tsne_coordinates.flags.writeable = False
+
+    # Calculate cluster IDs using DBSCAN; a k-d tree suits the 2D embedding,
+    # and its range queries run on every core
+    dbscan = DBSCAN(
+        eps=epsilon, min_samples=minpts, algorithm="kd_tree", leaf_size=40, n_jobs=-1
+    )
+    cluster_labels = dbscan.fit_predict(tsne_coordinates)
+    cluster_labels[cluster_labels != -1] = cluster_labels[cluster_labels != -1] + 1
+    cluster_labels.flags.writeable = False
+
+    return tsne_coordinates, cluster_labels
+
+
+def generate_tsne(
+    dge_file,
+    output_file=None,
+    marker_gene=None,
+    target_cluster=None,
+    epsilon=4,
+    minpts=40,
+    debug=False,
+    dge_data=None,
+    clusters=None,
+    return_figs=True,
+):
+    """
+    Generate t-SNE 2D coordinates from DGE file and cluster using DBSCAN.
+
+    Parameters:
+    - dge_file (str): The path to the DGE file.
+    - output_file (str): The path to the output file; defaults to
+      the same directory as the DGE file with a .tsne.npy extension.
+      Files with any other extension are read and written as CSV.
+    - marker_gene (str): The name of the marker gene to highlight.
+    - target_cluster (int): The target cluster to highlight.
+    - epsilon (int): The epsilon value for DBSCAN.
+    - minpts (int): The minpts value for DBSCAN.
+    - debug (bool): Whether to print debug information.
+    - dge_data (pandas.DataFrame): Already-loaded DGE data, as returned by
+      `load_dge`; if given, the DGE file is not read again.
+    - clusters (tuple): Precomputed `(tsne_coordinates, cluster_labels)`, as
+      returned by `compute_clusters`; if given, t-SNE and DBSCAN are skipped.
+    - return_figs (bool): Whether to build the Plotly figure; when False,
+      only the coordinates and expression mask are computed and fig is None.
+
+    Returns:
+    - filtered_tsne_coordinates (numpy.ndarray): A filtered set of t-SNE coordinates. If a marker gene or target cluster is specified, this contains only the coordinates for cells expressing the gene or belonging to the target cluster, respectively.
+    - is_expressing (numpy.ndarray or None): A boolean array indicating which cells (of the filtered set) are expressing the specified marker gene. If no marker gene is specified, this is None.
+    - fig (plotly.graph_objects.Figure): A Plotly figure object visualizing the t-SNE plot with either DBSCAN clusters or highlighted cells based on marker gene expression.
+    """
+
+    if debug:
+        print(f"Running in debug mode!")
+
+    if clusters is None:
+        clusters = compute_clusters(
+            dge_file,
+            output_file=output_file,
+            epsilon=epsilon,
+            minpts=minpts,
+            debug=debug,
+            dge_data=dge_data,
+        )
+
+    tsne_coordinates, cluster_labels = clusters
+
+    fig = go.Figure() if return_figs else None
+
     # Filter for returning later
     filtered_tsne_coordinates = tsne_coordinates
 
     if marker_gene:
-        if marker_gene in dge_data["GENE"].values:
-            gene_expression = dge_data[dge_data["GENE"] == marker_gene].drop(columns=["GENE"]).values.flatten()
-            is_expressing = gene_expression > 0
-            foreground_mask = is_expressing
+        # Read the DGE file
+        if dge_data is None:
+            dge_data = load_dge(dge_file)
+
+        # Find the gene's row with a single scan of the GENE column
+        gene_rows = np.flatnonzero(dge_data["GENE"].values == marker_gene)
+
+        if len(gene_rows) > 0:
+            gene_expression = expression_rows(dge_data, gene_rows).ravel()
+            foreground_mask = gene_expression > 0
 
             if target_cluster is not None:
                 cluster_mask = cluster_labels == target_cluster
-                is_expressing = is_expressing & cluster_mask
-                filtered_tsne_coordinates = tsne_coordinates[cluster_mask]
-                is_expressing = is_expressing[cluster_mask]
+                cluster_indices = np.flatnonzero(cluster_mask)
+
+                # Gather the cluster's cells once, for both the coordinates
+                # and their expression
+                filtered_tsne_coordinates = tsne_coordinates[cluster_indices]
+                is_expressing = foreground_mask[cluster_indices]
+
                 foreground_mask = foreground_mask & cluster_mask
                 background_mask = cluster_mask & ~foreground_mask
             else:
+                is_expressing = foreground_mask
                 background_mask = ~foreground_mask
 
-            fig.add_trace(
-                go.Scatter(
-                    x=tsne_coordinates[background_mask, 0],
-                    y=tsne_coordinates[background_mask, 1],
-                    mode="markers",
-                    marker=dict(color="lightgray", size=4, opacity=0.8),
-                    name="Background",
+            if return_figs:
+                # Gather each group's coordinates once, for both axes
+                background_xy = tsne_coordinates[np.flatnonzero(background_mask)]
+                foreground_xy = tsne_coordinates[np.flatnonzero(foreground_mask)]
+
+                fig.add_trace(
+                    go.Scattergl(
+                        x=background_xy[:, 0],
+                        y=background_xy[:, 1],
+                        mode="markers",
+                        marker=dict(color="lightgray", size=4, opacity=0.8),
+                        name="Background",
+                    )
                 )
-            )
-            fig.add_trace(
-                go.Scatter(
-                    x=tsne_coordinates[foreground_mask, 0],
-                    y=tsne_coordinates[foreground_mask, 1],
-                    mode="markers",
-                    marker=dict(color="red", size=4),
-                    name=f"Foreground ({marker_gene})",
+                fig.add_trace(
+                    go.Scattergl(
+                        x=foreground_xy[:, 0],
+                        y=foreground_xy[:, 1],
+                        mode="markers",
+                        marker=dict(color="red", size=4),
+                        name=f"Foreground ({marker_gene})",
+                    )
                 )
-            )
         else:
             print(f"Marker gene '{marker_gene}' not found in the DGE data.")
             return None, None
     elif target_cluster is not None:
         is_expressing = cluster_labels == target_cluster
         filtered_tsne_coordinates = tsne_coordinates[is_expressing]
-        mask = cluster_labels == target_cluster
-
-        fig.add_trace(
-            go.Scatter(
-                x=tsne_coordinates[mask, 0],
-                y=tsne_coordinates[mask, 1],
-                mode="markers",
-                marker=dict(size=5),
-                name=f"Cluster {target_cluster}",
+
+        if return_figs:
+            # The cluster's coordinates are already gathered
+            fig.add_trace(
+                go.Scattergl(
+                    x=filtered_tsne_coordinates[:, 0],
+                    y=filtered_tsne_coordinates[:, 1],
+                    mode="markers",
+                    marker=dict(size=5),
+                    name=f"Cluster {target_cluster}",
+                )
             )
-        )
     else:
         # Plot all clusters if no marker gene is specified
         is_expressing = None  # No marker gene, so no foreground/background
-        unique_labels = np.unique(cluster_labels)
-        for label in unique_labels:
-            mask = cluster_labels == label
-            fig.add_trace(
-                go.Scatter(
-                    x=tsne_coordinates[mask, 0],
-                    y=tsne_coordinates[mask, 1],
-                    mode="markers",
-                    marker=dict(size=5, opacity=0.1 if label == -1 else 1.0),
-                    name=f"Cluster {label}" if label != -1 else "Noise",
+        if return_figs:
+            # Group the cells by cluster with one sort, instead of one mask per cluster
+            order = np.argsort(cluster_labels, kind="stable")
+            unique_labels, starts = np.unique(cluster_labels[order], return_index=True)
+            for label, indices in zip(unique_labels, np.split(order, starts[1:])):
+                fig.add_trace(
+                    go.Scattergl(
+                        x=tsne_coordinates[indices, 0],
+                        y=tsne_coordinates[indices, 1],
+                        mode="markers",
+                        marker=dict(size=5, opacity=0.1 if label == -1 else 1.0),
+                        name=f"Cluster {label}" if label != -1 else "Noise",
+                    )
                 )
-            )
 
-    fig.update_layout(
-        title="t-SNE plot with DBSCAN clustering"
-        if not marker_gene
-        else f"t-SNE plot with {marker_gene} highlighted"
-    )
+    if return_figs:
+        fig.update_layout(
+            title="t-SNE plot with DBSCAN clustering"
+            if not marker_gene
+            else f"t-SNE plot with {marker_gene} highlighted"
+        )
 
     return filtered_tsne_coordinates, is_expressing, fig
 
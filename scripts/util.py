@@ -1,11 +1,9 @@
-import os
 import numpy as np
-import pandas as pd
 
-from scripts.tsne import generate_tsne
+from scripts.tsne import compute_clusters, expression_rows, load_dge
 
 
-def get_genes(dge_file, target_cluster=None):
+def get_genes(dge_file, target_cluster=None, dge_data=None, clusters=None):
     """
     Get genes from the DGE file. If target_cluster is specified, filter and
     return only the genes that are expressed in that cluster.
@@ -13,77 +11,75 @@ def get_genes(dge_file, target_cluster=None):
     Parameters:
     - dge_file (str): The path to the DGE file.
     - target_cluster (int, optional): The target cluster to filter by. Defaults to None.
+    - dge_data (pandas.DataFrame, optional): Already-loaded DGE data; if given, the DGE file is not read. Defaults to None.
+    - clusters (tuple, optional): Precomputed `(tsne_coordinates, cluster_labels)` from `compute_clusters`. Defaults to None.
 
     Returns:
     - list: List of genes.
     """
 
-    # Use the generate_tsne function to get t-SNE coordinates and clustering information
-    _, is_expressing_cells, _ = generate_tsne(dge_file, target_cluster=target_cluster)
-
-    # Read the DGE file to get gene names and expression matrix
-    split_filename = os.path.splitext(dge_file)[0]
-    if os.path.isfile(f"{split_filename}.dge.parquet"):
-        dge_data = pd.read_parquet(f"{split_filename}.dge.parquet")
-    else:
-        dge_data = pd.read_csv(dge_file, sep=None, engine="python")
+    if dge_data is None:
+        dge_data = load_dge(dge_file)
 
+    # Get gene names
     gene_names = dge_data["GENE"].values
-    expression_matrix = dge_data.drop(columns=["GENE"]).values
 
-    # Filter the expression matrix to only include cells from the target cluster
-    if is_expressing_cells is not None:
-        reduced_matrix = expression_matrix[:, is_expressing_cells]
+    # Filter the expression matrix to only include cells from the target cluster,
+    # which only needs the cluster labels
+    if target_cluster is not None:
+        if clusters is None:
+            clusters = compute_clusters(dge_file, dge_data=dge_data)
+
+        _, cluster_labels = clusters
+
+        # Only copy the columns of the cluster's cells out of the DataFrame,
+        # shifted past the "GENE" column
+        cluster_columns = np.flatnonzero(cluster_labels == target_cluster) + 1
+        reduced_matrix = dge_data.iloc[:, cluster_columns].values
     else:
-        reduced_matrix = expression_matrix
+        reduced_matrix = dge_data.drop(columns=["GENE"]).values
 
     # Get the list of genes that are expressed in any of the cells in the target cluster
-    expressed_genes = [
-        gene
-        for gene, expression in zip(gene_names, reduced_matrix)
-        if np.any(expression > 0)
-    ]
+    is_expressed = np.any(reduced_matrix > 0, axis=1)
 
-    return expressed_genes
+    return gene_names[is_expressed].tolist()
 
 
-def get_gene_info(dge_file, target_gene):
+def get_gene_info(dge_file, target_gene, dge_data=None):
     """
     Get gene information including name, coverage, mean expression, and total expression.
 
     Parameters:
     - dge_file (str): The path to the DGE file.
     - target_gene (str): The target gene to get information for.
+    - dge_data (pandas.DataFrame, optional): Already-loaded DGE data; if given, the DGE file is not read. Defaults to None.
 
     Returns:
     - tuple: (gene_name, coverage, mean_expression, total_expression) or None if the gene is not found.
     """
 
     # Load the DGE data
-    split_filename = os.path.splitext(dge_file)[0]
-    if os.path.isfile(f"{split_filename}.dge.parquet"):
-        dge_data = pd.read_parquet(f"{split_filename}.dge.parquet")
-    else:
-        dge_data = pd.read_csv(dge_file, sep=None, engine="python")
+    if dge_data is None:
+        dge_data = load_dge(dge_file)
+
+    # Find the rows of the target gene in a single scan of the gene names
+    gene_rows = np.flatnonzero(dge_data["GENE"].values == target_gene)
 
     # Check if the target gene exists in the data
-    if target_gene in dge_data["GENE"].values:
-        gene_expression_values = (
-            dge_data[dge_data["GENE"] == target_gene]
-            .drop(columns=["GENE"])
-            .values.flatten()
-        )
+    if len(gene_rows) > 0:
+        gene_expression_values = expression_rows(dge_data, gene_rows).ravel()
 
         # Calculate metrics
         gene_name = target_gene
 
         # Coverage: Percentage of non-zero expressions
-        foreground = (gene_expression_values > 0).sum()
+        foreground = np.count_nonzero(gene_expression_values > 0)
         total_samples = len(gene_expression_values)
         coverage = (foreground / total_samples) * 100
 
-        mean_expression = gene_expression_values.mean()
+        # The mean follows from the total, so the values are only summed once
         total_expression = gene_expression_values.sum()
+        mean_expression = total_expression / total_samples
 
         return (gene_name, coverage, mean_expression, total_expression)
 
@@ -129,23 +125,18 @@ def migrate_to_new_dge_format(input_path, output_path):
     - Path to the processed file.
     """
 
-    # Reading the input file
-    with open(input_path, "r") as file_mca1:
-        mca1_content = file_mca1.read()
-
-    # Removing quotation marks
-    mca1_content = mca1_content.replace('"', "")
-
-    # Changing the delimiter from space to tab
-    mca1_content = mca1_content.replace(" ", "\t")
+    # Removing quotation marks and changing the delimiter from space to tab,
+    # in a single pass per line
+    translation = str.maketrans({'"': None, " ": "\t"})
 
-    # Adding the "GENE" column header and removing "NeonatalHeart_1." prefix
-    mca1_lines = mca1_content.splitlines()
-    mca1_lines[0] = "GENE\t" + mca1_lines[0].replace("NeonatalHeart_1.", "")
-    mca1_processed_content = "\n".join(mca1_lines)
+    # Stream the file line by line, so it is never held in memory in full
+    with open(input_path, "r") as file_mca1, open(output_path, "w") as output_file:
+        # Adding the "GENE" column header and removing "NeonatalHeart_1." prefix
+        header = next(file_mca1).rstrip("\n").translate(translation)
+        output_file.write("GENE\t" + header.replace("NeonatalHeart_1.", ""))
 
-    # Saving the processed content to the output path
-    with open(output_path, "w") as output_file:
-        output_file.write(mca1_processed_content)
+        # Saving the processed content to the output path
+        for line in file_mca1:
+            output_file.write("\n" + line.rstrip("\n").translate(translation))
 
     return output_path
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
@@ -5,7 +7,6 @@ from dash.dependencies import Input, Output
 import webbrowser
 from threading import Timer
 
-from scripts.tsne import generate_tsne
 from scripts.simulation import plot_simulated_cells
 from scripts.rsp import generate_polygon
 
@@ -20,8 +21,13 @@ app.layout = html.Div(
             [
                 html.Div(
                     [
-                        dcc.Graph(id="tsne-plot", style={"width": "50%"}),
-                        dcc.Graph(id="rsp-plot", style={"width": "50%"}),
+                        # Show a spinner on each graph while its figure is computed
+                        dcc.Loading(
+                            dcc.Graph(id="tsne-plot"), parent_style={"width": "50%"}
+                        ),
+                        dcc.Loading(
+                            dcc.Graph(id="rsp-plot"), parent_style={"width": "50%"}
+                        ),
                     ],
                     style={"display": "flex", "justifyContent": "space-between"},
                 ),
@@ -35,6 +41,8 @@ app.layout = html.Div(
                             value=50,
                             marks={i: f"{i}%" for i in range(0, 101, 10)},
                             step=0.1,
+                            # Only send the value once a drag is released
+                            updatemode="mouseup",
                         ),
                     ],
                 ),
@@ -90,6 +98,13 @@ def update_plots(percentage_value, seed_value, distribution_type):
     expression_percentage = percentage_value / 100
     seed = seed_value if seed_value is not None else 42
     distribution_type = distribution_type if distribution_type is not None else "biased"
+    return simulate(round(expression_percentage, 3), seed, distribution_type)
+
+
+@lru_cache(maxsize=256)
+def simulate(expression_percentage, seed, distribution_type):
+    # The simulation is seeded, so revisiting a slider position can reuse its figures;
+    # they are kept as plain dicts, which Dash serializes without converting them again
     coordinates, is_expressing, fig1 = plot_simulated_cells(
         num_points=1000,
         expression_percentage=expression_percentage,
@@ -98,10 +113,14 @@ def update_plots(percentage_value, seed_value, distribution_type):
         seed=seed,
     )
     fig2, _ = generate_polygon(coordinates, is_expressing)
-    return fig1, fig2
+    return fig1.to_plotly_json(), fig2.to_plotly_json()
 
 
 # Run the Dash app
 if __name__ == "__main__":
+    # Compute the figures for the initial controls up front, so the first page
+    # load is served from the cache
+    update_plots(50, None, "biased")
+
     Timer(1, lambda: webbrowser.open("http://127.0.0.1:8050/")).start()
     app.run_server(debug=True, use_reloader=False)
@@ -0,0 +1,42 @@
+import numpy as np
+
+from scripts.rsp import generate_polygon, rsp_areas
+
+
+def test_generate_polygon_with_coincident_coordinates():
+    coordinates = np.ones((10, 2))
+    is_expressing = np.arange(10) < 3
+
+    rsp_fig, polygon_area = generate_polygon(coordinates, is_expressing)
+
+    assert polygon_area == 0
+    assert np.isfinite(rsp_fig.data[0].r).all()
+
+
+def test_rsp_areas_with_collinear_coordinates():
+    # Every point projects to 0 at the first angle, which is perpendicular to the line
+    coordinates = np.column_stack([np.zeros(50), np.linspace(-1, 1, 50)])
+    is_expressing = np.stack([np.arange(50) < 10, np.arange(50) % 2 == 0])
+
+    areas = rsp_areas(coordinates, is_expressing)
+
+    assert np.isfinite(areas).all()
+    for area, gene_expressing in zip(areas, is_expressing):
+        _, polygon_area = generate_polygon(
+            coordinates, gene_expressing, return_figs=False
+        )
+        assert np.isclose(area, polygon_area)
+
+
+def test_rsp_areas_match_generate_polygon():
+    rng = np.random.default_rng(0)
+    coordinates = rng.normal(size=(500, 2))
+    is_expressing = rng.random((3, 500)) < 0.3
+
+    areas = rsp_areas(coordinates, is_expressing)
+
+    for area, gene_expressing in zip(areas, is_expressing):
+        _, polygon_area = generate_polygon(
+            coordinates, gene_expressing, return_figs=False
+        )
+        assert np.isclose(area, polygon_area)
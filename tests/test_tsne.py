@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from scripts.tsne import load_dge
+from scripts.util import get_gene_info
+
+
+def write_dge(path, rows):
+    path.write_text("\n".join("\t".join(row) for row in rows) + "\n")
+    return str(path)
+
+
+def test_load_dge_reads_empty_cells_as_nan(tmp_path):
+    dge_file = write_dge(
+        tmp_path / "dge.txt",
+        [
+            ["GENE", "cell_1", "cell_2", "cell_3"],
+            ["Gene1", "1", "", "2"],
+            ["Gene2", "0", "3", "1"],
+        ],
+    )
+
+    dge_data = load_dge(dge_file)
+
+    assert dge_data.dtypes.iloc[1:].eq(np.float64).all()
+    assert np.isnan(dge_data.iloc[0, 2])
+
+    _, coverage, mean_expression, total_expression = get_gene_info(
+        dge_file, "Gene1", dge_data=dge_data
+    )
+    assert coverage == 2 / 3 * 100
+    assert np.isnan(mean_expression)
+    assert np.isnan(total_expression)
+
+
+def test_load_dge_reads_all_empty_cell_as_nan(tmp_path):
+    dge_file = write_dge(
+        tmp_path / "dge.txt",
+        [
+            ["GENE", "cell_1", "cell_2"],
+            ["Gene1", "1", ""],
+            ["Gene2", "0", ""],
+        ],
+    )
+
+    dge_data = load_dge(dge_file)
+
+    assert dge_data.dtypes.iloc[1:].eq(np.float64).all()
+    assert np.isnan(dge_data["cell_2"]).all()
+    assert dge_data["cell_1"].tolist() == [1, 0]
+
+
+def test_load_dge_is_read_only(tmp_path):
+    dge_file = write_dge(
+        tmp_path / "dge.txt",
+        [["GENE", "cell_1"], ["Gene1", "1"]],
+    )
+
+    dge_data = load_dge(dge_file)
+
+    with pytest.raises(ValueError):
+        dge_data.iloc[0, 1] = 5